@@ -1,19 +1,86 @@
 # chat_widget.py
+import json
 import time
+import uuid
+import random
 import datetime as _dt
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 from typing import Any, Dict, List, Optional
 
+try:  # optional: faster JSON encode/decode for payloads and replies
+    import orjson as _orjson
+except ImportError:
+    _orjson = None
+
 DEFAULT_WEBHOOK = "https://d-target-sb.d-rive.click/webhook/ai-data-analysis-v3"
 SESSION_HISTORY_KEY = "chat_history"
 SESSION_OPEN_KEY = "chat_open"
+PRESET_KEY = "chat_preset_label"
+COMPOSER_KEY = "chat_preset_text"
+DATE_KEY = "chat_preset_date"
+_TODAY_KEY = "_chat_today"
+_TODAY_TTL_SECS = 3600
+_PENDING_KEY = "_chat_pending"  # future of the in-flight webhook call
+_HISTORY_READY_KEY = "_chat_history_ready"  # set once history is a deque of tuples
+_OUTBOX_KEY = "_chat_outbox"  # (slot, message) handed from the fragment to a full-app run
+SESSION_ID_KEY = "_chat_session_id"
+
+# Streaming replies: content types treated as SSE/NDJSON and the minimum
+# interval (seconds) between placeholder repaints while tokens arrive.
+_STREAM_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson", "application/jsonl")
+_STREAM_FLUSH_SECS = 0.03
+# JSON reply keys checked in order for the assistant text.
+_REPLY_KEYS = ("reply", "message", "text")
+# Messages rendered inline in the card; older ones are tucked into an expander.
+_VISIBLE_MESSAGES = 12
+
+# Default preset composer entries; built once at import rather than per rerun.
+_DEFAULT_PRESETS = (
+    {
+        "label": "Weekly performance by brand",
+        "template": (
+            "Generate weekly performance including buyers purchases total sales and total units grouped by Brand "
+            "using Upload_Date for the weekly bucket from the table Haleon_Rewards_User_Performance_110925_SKUs."
+        ),
+    },
+    {
+        "label": "Overall totals",
+        "template": (
+            "Compute overall totals including purchases counted as distinct receiptid total sales as the sum of Total Sales Amount "
+            "total units as the sum of Total_Purchase_Units and buyers as the unique count of comuserid from the table Haleon_Rewards_User_Performance_110925_SKUs."
+        ),
+    },
+    {
+        "label": "Monthly sales and units by brand",
+        "template": (
+            "Show monthly totals grouped by Brand using Upload_Date for the month bucket including purchases total sales total units and buyers "
+            "from the table Haleon_Rewards_User_Performance_110925_SKUs."
+        ),
+    },
+    {
+        "label": "Top 10 brands by total sales",
+        "template": (
+            "Return the top 10 brands ordered by total sales calculated as the sum of Total Sales Amount "
+            "from the table Haleon_Rewards_User_Performance_110925_SKUs."
+        ),
+    },
+)
+_PRESET_BY_LABEL = {p["label"]: p["template"] for p in _DEFAULT_PRESETS}
 
 # ---------------------------
 # Compatibility shims (old Streamlit)
 # ---------------------------
 _HAS_CHAT_MESSAGE = hasattr(st, "chat_message")
 _HAS_CHAT_INPUT = hasattr(st, "chat_input")
+_FRAGMENT = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None)
+
+def _maybe_fragment(fn):
+    """Wrap ``fn`` as a Streamlit fragment (scoped reruns) when available."""
+    return _FRAGMENT(fn) if _FRAGMENT is not None else fn
 
 def _render_msg(ui, role: str, content: str):
     role_norm = "assistant" if role == "assistant" else "user"
@@ -35,44 +102,314 @@ def _get_input(ui, placeholder: str, key: str) -> Optional[str]:
 # ---------------------------
 # HTTP helper
 # ---------------------------
+def _json_dumps(obj: Any) -> bytes:
+    if _orjson is not None:
+        return _orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def _json_loads(raw):
+    return _orjson.loads(raw) if _orjson is not None else json.loads(raw)
+
+@st.cache_resource(show_spinner=False)
+def _http_session() -> requests.Session:
+    """Pooled keep-alive session shared by every user session and rerun.
+
+    Cached as a resource (not data) so the TCP/TLS connections to the webhook
+    are reused across the whole server instead of handshaking per message.
+    """
+    s = requests.Session()
+    # Retries are handled (with jitter) by _post_with_retry, not the adapter
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=0)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    s.headers.update({"Connection": "keep-alive"})
+    return s
+
 def _post_with_retry(
     url: str,
     json_body: Dict[str, Any],
-    timeout: float = 30,
-    retries: int = 2,
-    backoff: float = 1.5,
+    timeout: Any = 30,
+    retries: int = 3,
+    backoff: float = 0.1,
+    max_backoff: float = 5.0,
+    stream: bool = False,
+    session: Optional[requests.Session] = None,
 ):
-    """Send POST request with simple retry/backoff."""
+    """Send POST request with decorrelated-jitter retry/backoff.
+
+    Only connection failures (including connect timeouts), HTTP 429 and 5xx
+    are retried. Read timeouts and other request errors raise immediately:
+    the workflow may already be running, and a resend would run it twice.
+    With ``stream=True`` the body is left unread for the caller to iterate.
+    Pass ``session`` when calling off the script thread (see _post_in_background).
+    """
+    session = session or _http_session()
+    body = _json_dumps(json_body)
     err = None
+    delay = backoff
     for attempt in range(retries + 1):
         try:
-            r = requests.post(url, json=json_body, timeout=timeout)
+            r = session.post(
+                url,
+                data=body,
+                timeout=timeout,
+                stream=stream,
+                headers={
+                    "Content-Type": "application/json",
+                    "Accept": ", ".join(_STREAM_CONTENT_TYPES + ("application/json",)),
+                },
+            )
+        except requests.ConnectionError as e:  # ConnectTimeout is a subclass
+            err = e
+        else:
             if 200 <= r.status_code < 300:
                 return r
             err = RuntimeError(f"HTTP {r.status_code}: {r.text}")
-        except Exception as e:
-            err = e
-        time.sleep(backoff ** (attempt + 1))
+            if r.status_code != 429 and r.status_code < 500:
+                raise err
+        if attempt < retries:
+            delay = min(max_backoff, random.uniform(backoff, delay * 3))
+            time.sleep(delay)
     raise err if err else RuntimeError("Unknown request error")
 
+def _submit_worker(fn, *args, **kwargs):
+    """Run ``fn`` on its own short-lived worker thread and return the future.
+
+    One thread per request (like the per-session script thread it replaces):
+    no process-wide cap on concurrent chats, and an abandoned request only
+    ties up its own thread until its timeout.
+    """
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-webhook")
+    try:
+        return pool.submit(fn, *args, **kwargs)
+    finally:
+        pool.shutdown(wait=False)
+
+_THINKING_FRAMES = ("⠋", "⠙", "⠹", "⠸")
+
+def _discard_response(fut):
+    # Done-callback for an abandoned request: release its pooled connection
+    if not fut.cancelled() and fut.exception() is None:
+        fut.result().close()
+
+def _settle_stopped_request():
+    """Record a webhook call whose script run was interrupted as stopped.
+
+    Sends run in a full-app pass, so clicking Stop (or any other widget) asks
+    for a full rerun, which aborts the waiting/streaming run at its next
+    element call before it could persist the reply.
+    The abandoned future is still under _PENDING_KEY: add a "(stopped)" reply
+    and close the response once the worker finishes.
+    """
+    fut = st.session_state.pop(_PENDING_KEY, None)
+    if fut is None:
+        return
+    fut.cancel()
+    fut.add_done_callback(_discard_response)
+    hist = st.session_state.get(SESSION_HISTORY_KEY)
+    if hist is not None:
+        hist.append(("assistant", "(stopped)"))
+
+def _post_in_background(
+    placeholder,
+    url: str,
+    json_body: Dict[str, Any],
+    session: Optional[requests.Session] = None,
+    **kwargs,
+):
+    """Run _post_with_retry on a worker thread while animating ``placeholder``.
+
+    The future stays under _PENDING_KEY until the caller persists the reply,
+    so a rerun that interrupts this run can settle it (_settle_stopped_request).
+    """
+    fut = _submit_worker(_post_with_retry, url, json_body, session=session or _http_session(), **kwargs)
+    st.session_state[_PENDING_KEY] = fut
+    frame = 0
+    while not fut.done():
+        placeholder.markdown(f"Thinking… {_THINKING_FRAMES[frame % len(_THINKING_FRAMES)]}")
+        frame += 1
+        time.sleep(0.1)
+    return fut.result()
+
+def _delta_text(frame: Any) -> str:
+    """Extract the text fragment from one decoded stream frame."""
+    if not isinstance(frame, dict):
+        return frame if isinstance(frame, str) else ""
+    delta = frame.get("delta")
+    if isinstance(delta, dict):
+        delta = delta.get("text") or delta.get("content")
+    for v in (delta, frame.get("content"), frame.get("text")):
+        if isinstance(v, str):
+            return v
+    return ""
+
+def _iter_stream(resp):
+    """Yield text deltas from an SSE (``data: {...}``) or NDJSON response."""
+    for line in resp.iter_lines(decode_unicode=True):
+        if not line or line.startswith((":", "event:", "id:", "retry:")):
+            continue
+        if line.startswith("data:"):
+            # SSE drops one optional space after the colon; any further
+            # whitespace is part of the token (e.g. " world")
+            line = line[5:]
+            if line.startswith(" "):
+                line = line[1:]
+        if line == "[DONE]":
+            break
+        try:
+            frame = _json_loads(line)
+        except ValueError:
+            frame = line
+        # Bare JSON scalars ("42", "true") are plain-text tokens, not frames
+        text = _delta_text(frame) if isinstance(frame, (dict, str)) else line
+        if text:
+            yield text
+
+def _render_reply(resp, placeholder):
+    """Render the webhook reply into ``placeholder``; return ``(reply_txt, data)``.
+
+    Streaming responses are painted incrementally (throttled to
+    ``_STREAM_FLUSH_SECS``); plain JSON/text responses are rendered once.
+    """
+    ctype = resp.headers.get("Content-Type", "").split(";")[0].strip().lower()
+    if ctype in _STREAM_CONTENT_TYPES:
+        # SSE/NDJSON are UTF-8; without a declared charset requests would
+        # yield bytes (NDJSON) or decode as ISO-8859-1 (event-stream)
+        resp.encoding = "utf-8"
+        accum = ""
+        last_flush = 0.0
+        with resp:
+            for text in _iter_stream(resp):
+                accum += text
+                now = time.monotonic()
+                if now - last_flush >= _STREAM_FLUSH_SECS:
+                    placeholder.markdown(accum + "▌")
+                    last_flush = now
+        reply_txt = accum.strip() or "(No reply)"
+        placeholder.markdown(reply_txt)
+        return reply_txt, {}
+
+    try:
+        data = _json_loads(resp.content)
+    except Exception:
+        data = {"reply": resp.text}
+    if not isinstance(data, dict):
+        data = {"reply": data if isinstance(data, str) else resp.text}
+
+    reply_txt = next(
+        (t for k in _REPLY_KEYS if isinstance(v := data.get(k), str) and (t := v.strip())),
+        "(No reply)",
+    )
+
+    placeholder.markdown(reply_txt)
+    return reply_txt, data
+
 # ---------------------------
 # Session/state helpers
 # ---------------------------
-def _init_state(default_open: bool):
-    # Ensure history is a list of {role, content}
+def _init_state(max_history: int):
+    # Stable per-browser-session id so the webhook can keep history server-side
+    if SESSION_ID_KEY not in st.session_state:
+        st.session_state[SESSION_ID_KEY] = str(uuid.uuid4())
+    # Ensure history is a bounded deque of (role, content) tuples; the oldest
+    # messages fall off automatically once max_history is reached.
     hist = st.session_state.get(SESSION_HISTORY_KEY)
-    if not isinstance(hist, list):
-        st.session_state[SESSION_HISTORY_KEY] = []
-    else:
-        st.session_state[SESSION_HISTORY_KEY] = [
-            m for m in hist if isinstance(m, dict) and "role" in m and "content" in m
-        ]
-    if SESSION_OPEN_KEY not in st.session_state:
-        st.session_state[SESSION_OPEN_KEY] = default_open
-
-def _badge(label: str, live: bool = True):
+    # Fast path: already rebuilt this session. The flag (not a per-entry scan)
+    # marks it, since deques from older sessions may still hold dicts
+    if st.session_state.get(_HISTORY_READY_KEY) and isinstance(hist, deque) and hist.maxlen == max_history:
+        return
+    if not isinstance(hist, (list, deque)):
+        hist = ()
+    msgs = deque(maxlen=max_history)
+    for m in hist:
+        if isinstance(m, tuple) and len(m) == 2:
+            msgs.append(m)
+        elif isinstance(m, dict) and "role" in m and "content" in m:
+            msgs.append((m["role"], m["content"]))  # legacy {role, content} dicts
+    st.session_state[SESSION_HISTORY_KEY] = msgs
+    st.session_state[_HISTORY_READY_KEY] = True
+
+def _history_payload(window: int) -> List[Dict[str, Any]]:
+    # Last ``window`` messages in the {role, content} shape the webhook expects
+    hist = st.session_state[SESSION_HISTORY_KEY]
+    tail = list(hist)[-window:] if window > 0 else []
+    return [{"role": role, "content": content} for role, content in tail]
+
+def _badge(label: str, live: bool = True) -> str:
     dot = "🟢" if live else "🔵"
-    st.caption(f"{dot} {label}")
+    return f"{dot} {label}"
+
+def _cached_today() -> _dt.date:
+    """Today's date, re-read from the clock at most once an hour per session."""
+    now = time.monotonic()
+    cached = st.session_state.get(_TODAY_KEY)
+    if cached is None or now - cached[0] >= _TODAY_TTL_SECS:
+        cached = (now, _dt.date.today())
+        st.session_state[_TODAY_KEY] = cached
+    return cached[1]
+
+def _apply_preset(preset_by_label: Dict[str, str]):
+    # Selectbox callback: load the chosen preset's template into the composer
+    st.session_state[COMPOSER_KEY] = preset_by_label.get(st.session_state.get(PRESET_KEY), "")
+
+def _send_and_render(
+    message: str,
+    *,
+    webhook_url: str,
+    system_hint: str,
+    context: Optional[Dict[str, Any]],
+    history_window: int,
+    session: Optional[requests.Session],
+    stop_key: str,
+):
+    """Echo ``message``, send it to the webhook and render/persist the reply.
+
+    Shared by the preset composer and the follow-up chat input.
+    """
+    st.session_state[SESSION_HISTORY_KEY].append(("user", message))
+    _render_msg(st, "user", message)
+
+    # Payload
+    payload: Dict[str, Any] = {
+        "message": message,
+        "session_id": st.session_state[SESSION_ID_KEY],
+        "history": _history_payload(history_window),
+        "system": system_hint,
+        "source": "streamlit",
+    }
+    if context is not None:
+        payload["context"] = context
+
+    # Call webhook
+    with (st.chat_message("assistant") if _HAS_CHAT_MESSAGE else st.container()):
+        placeholder = st.empty()
+        # Sends never run inside the fragment, so clicking Stop requests a full
+        # rerun that interrupts this run at its next element call (the thinking
+        # animation or a streamed-token flush); the next run settles the request
+        stop_slot = st.empty()
+        stop_slot.button("Stop", key=stop_key)
+        try:
+            resp = _post_in_background(
+                placeholder, webhook_url, payload,
+                session=session, timeout=(10, 300), stream=True,
+            )
+            reply_txt, data = _render_reply(resp, placeholder)
+        except Exception as e:
+            reply_txt, data = f"Error: {e}", {}
+            placeholder.error(reply_txt)
+
+        # Persist assistant reply before any further element call, so a
+        # rerun from here on cannot record it as stopped
+        st.session_state.pop(_PENDING_KEY, None)
+        st.session_state[SESSION_HISTORY_KEY].append(("assistant", reply_txt))
+        stop_slot.empty()
+
+        suggestions = data.get("suggestions")
+        if isinstance(suggestions, list) and suggestions:
+            st.caption("Try:")
+            for s in suggestions[:5]:
+                if isinstance(s, str):
+                    st.code(s)
 
 # ---------------------------
 # Main widget
@@ -90,59 +427,95 @@ def render_chat_widget_modern(
     show_on_sidebar_toggle: bool = False,
     clear_button: bool = True,
     max_history: int = 40,
+    history_window: int = 10,  # most recent messages sent to the webhook
     # --- NEW: preset composer ---
     enable_presets: bool = True,
     date_mode: str = "range",  # "range" or "single"
     presets: Optional[List[Dict[str, str]]] = None,
+    session: Optional[requests.Session] = None,
 ):
     """
     Modern, card-styled chat widget with a toggle to show/hide.
     Adds a preset composer with a date picker on the right (single/range).
     Pure Streamlit (no custom components). Backward compatible with older Streamlit.
+    The card runs as a fragment where supported, so chat interactions rerun
+    only the widget instead of the whole page; sending a message hands off to
+    one full-app run so its Stop button can interrupt the request.
+    Pass ``session`` to use your own (e.g. authenticated) requests.Session
+    instead of the shared pooled one.
     """
-    _init_state(default_open)
+    # Only the open/closed flag is needed up front; the collapsed path renders
+    # just the toggle and skips history validation and all card elements.
+    if SESSION_OPEN_KEY not in st.session_state:
+        st.session_state[SESSION_OPEN_KEY] = default_open
 
-        # ----- presets default -----
-    if presets is None:
-        presets = [
-            {
-                "label": "Weekly performance by brand",
-                "template": (
-                    "Generate weekly performance including buyers purchases total sales and total units grouped by Brand "
-                    "using Upload_Date for the weekly bucket from the table Haleon_Rewards_User_Performance_110925_SKUs."
-                ),
-            },
-            {
-                "label": "Overall totals",
-                "template": (
-                    "Compute overall totals including purchases counted as distinct receiptid total sales as the sum of Total Sales Amount "
-                    "total units as the sum of Total_Purchase_Units and buyers as the unique count of comuserid from the table Haleon_Rewards_User_Performance_110925_SKUs."
-                ),
-            },
-            {
-                "label": "Monthly sales and units by brand",
-                "template": (
-                    "Show monthly totals grouped by Brand using Upload_Date for the month bucket including purchases total sales total units and buyers "
-                    "from the table Haleon_Rewards_User_Performance_110925_SKUs."
-                ),
-            },
-            {
-                "label": "Top 10 brands by total sales",
-                "template": (
-                    "Return the top 10 brands ordered by total sales calculated as the sum of Total Sales Amount "
-                    "from the table Haleon_Rewards_User_Performance_110925_SKUs."
-                ),
-            },
-        ]
-
-
-    # Optional extra toggle in sidebar
+    # Optional extra toggle in sidebar (fragments can't write to the sidebar)
     if show_on_sidebar_toggle:
         with st.sidebar:
             st.toggle("Open chat", key=SESSION_OPEN_KEY)
 
+    # A message queued by the fragment is sent from a full-app pass: clicks
+    # inside a fragment queue behind the running fragment instead of
+    # interrupting it, which would leave Stop unable to cut the send short.
+    outbox = st.session_state.pop(_OUTBOX_KEY, None)
+    in_fragment = _FRAGMENT is not None and outbox is None
+    card = _chat_card_fragment if in_fragment else _chat_card
+    card(
+        in_fragment=in_fragment,
+        outbox=outbox,
+        webhook_url=webhook_url,
+        title=title,
+        subtitle=subtitle,
+        status=status,
+        live=live,
+        system_hint=system_hint,
+        context=context,
+        clear_button=clear_button,
+        max_history=max_history,
+        history_window=history_window,
+        enable_presets=enable_presets,
+        date_mode=date_mode,
+        presets=presets,
+        session=session,
+    )
+
+def _chat_card(
+    *,
+    in_fragment: bool,
+    outbox: Optional[tuple],
+    webhook_url: str,
+    title: str,
+    subtitle: str,
+    status: str,
+    live: bool,
+    system_hint: str,
+    context: Optional[Dict[str, Any]],
+    clear_button: bool,
+    max_history: int,
+    history_window: int,
+    enable_presets: bool,
+    date_mode: str,
+    presets: Optional[List[Dict[str, str]]],
+    session: Optional[requests.Session],
+):
+    def _submit(slot: str, message: str):
+        # In the fragment, queue the message for a full-app run (see
+        # render_chat_widget_modern); otherwise send it right here
+        if in_fragment:
+            st.session_state[_OUTBOX_KEY] = (slot, message)
+            st.rerun()
+        _send_and_render(
+            message,
+            webhook_url=webhook_url,
+            system_hint=system_hint,
+            context=context,
+            history_window=history_window,
+            session=session,
+            stop_key=f"chat_stop_{slot}",
+        )
+
     # Top toggle button (circle, icon-only)
-    left, mid, right = st.columns([1, 6, 2])
+    left, _ = st.columns([1, 8])
     with left:
         btn_label = "💬" if not st.session_state[SESSION_OPEN_KEY] else "➖"
         st.button(
@@ -154,20 +527,27 @@ def render_chat_widget_modern(
                 {SESSION_OPEN_KEY: not st.session_state[SESSION_OPEN_KEY]}
             ),
         )
-    with mid:
-        st.write("")  # spacer
-    with right:
-        pass
+
+    # A previous run cut short by Stop (or any other rerun) left its request pending
+    _settle_stopped_request()
 
     # Collapsed → return early
     if not st.session_state[SESSION_OPEN_KEY]:
         return
 
+    _init_state(max_history)
+
+    if presets is None:
+        presets = _DEFAULT_PRESETS
+        preset_by_label = _PRESET_BY_LABEL
+    else:
+        preset_by_label = {p["label"]: p["template"] for p in presets}
+
     # Keys for composer state
-    _today = _dt.date.today()
-    preset_key = "chat_preset_label"
-    composer_key = "chat_preset_text"
-    date_key = "chat_preset_date"
+    _today = _cached_today()
+    preset_key = PRESET_KEY
+    composer_key = COMPOSER_KEY
+    date_key = DATE_KEY
 
     # Initialize composer defaults if missing
     if composer_key not in st.session_state:
@@ -186,11 +566,7 @@ def render_chat_widget_modern(
             st.markdown("### ✨")
         with top[1]:
             st.subheader(title, anchor=False)
-            row = st.columns([3, 3])
-            with row[0]:
-                st.caption(subtitle)
-            with row[1]:
-                _badge(status, live=live)
+            st.caption(f"{subtitle} · {_badge(status, live=live)}")
         with top[2]:
             st.button("⚙️", help="Agent settings", use_container_width=True)
 
@@ -201,17 +577,13 @@ def render_chat_widget_modern(
             c_left, c_right = st.columns([3, 2], gap="large")
             with c_left:
                 st.caption("Preset")
-                def _apply_preset():
-                    label = st.session_state.get(preset_key)
-                    tmpl = next((p["template"] for p in presets if p["label"] == label), "")
-                    st.session_state[composer_key] = tmpl
-
                 st.selectbox(
                     "Choose a preset",
                     options=[p["label"] for p in presets],
                     key=preset_key,
                     index=0,
                     on_change=_apply_preset,
+                    args=(preset_by_label,),
                 )
                 st.text_area(
                     "Message to send",
@@ -241,83 +613,45 @@ def render_chat_widget_modern(
             with submit_cols[1]:
                 st.caption("Fill message and optionally set date(s), then click send.")
 
+            preset_msg = outbox[1] if outbox is not None and outbox[0] == "preset" else None
             if send_preset:
                 # Build message from preset + date(s) as plain sentences (no quotes/backticks)
                 base_msg = (st.session_state.get(composer_key) or "").strip()
+                dv = st.session_state.get(date_key)
                 if date_mode == "range":
-                    try:
-                        start, end = st.session_state.get(date_key, (_today, _today))
-                    except Exception:
-                        start, end = _today, _today
-                    date_clause = f" This request is for the period from {start} to {end}."
+                    # date_input yields a 1-tuple while only the start is picked
+                    start, end = dv if isinstance(dv, tuple) and len(dv) == 2 else (_today, _today)
+                    date_clause = f" This request is for the period from {start.isoformat()} to {end.isoformat()}."
                 else:
-                    the_date = st.session_state.get(date_key, _today)
-                    date_clause = f" This request is for the date {the_date}."
-                composed = (base_msg + date_clause).strip()
+                    the_date = dv if isinstance(dv, _dt.date) else _today
+                    date_clause = f" This request is for the date {the_date.isoformat()}."
+                preset_msg = (base_msg + date_clause).strip()
 
+            if preset_msg:
                 # Echo and send via the same pipeline as chat input
-                st.session_state[SESSION_HISTORY_KEY].append({"role": "user", "content": composed})
-                _render_msg(st, "user", composed)
-
-                # Payload
-                payload: Dict[str, Any] = {
-                    "message": composed,
-                    "history": st.session_state[SESSION_HISTORY_KEY],
-                    "system": system_hint,
-                    "source": "streamlit",
-                }
-                if context is not None:
-                    payload["context"] = context
-
-                with (st.chat_message("assistant") if _HAS_CHAT_MESSAGE else st.container()):
-                    placeholder = st.empty()
-                    with st.spinner("Thinking…"):
-                        try:
-                            resp = _post_with_retry(webhook_url, payload, timeout=60)
-                            try:
-                                data = resp.json()
-                            except Exception:
-                                data = {"reply": resp.text}
-
-                            reply_txt = None
-                            for k in ("reply", "message", "text"):
-                                v = data.get(k)
-                                if isinstance(v, str) and v.strip():
-                                    reply_txt = v.strip()
-                                    break
-                            if not reply_txt:
-                                reply_txt = "(No reply)"
-
-                            placeholder.markdown(reply_txt)
-
-                            suggestions = data.get("suggestions")
-                            if isinstance(suggestions, list) and suggestions:
-                                st.caption("Try:")
-                                for s in suggestions[:5]:
-                                    if isinstance(s, str):
-                                        st.code(s)
-                        except Exception as e:
-                            reply_txt = f"Error: {e}"
-                            placeholder.error(reply_txt)
-
-                st.session_state[SESSION_HISTORY_KEY].append({"role": "assistant", "content": reply_txt})
-
-                # Cap history size
-                if len(st.session_state[SESSION_HISTORY_KEY]) > max_history:
-                    st.session_state[SESSION_HISTORY_KEY] = st.session_state[SESSION_HISTORY_KEY][-max_history:]
+                _submit("preset", preset_msg)
 
                 # After sending preset, add a divider before message history
                 st.divider()
 
         # ---------- MESSAGES ----------
-        history = st.session_state.get(SESSION_HISTORY_KEY, [])
-        if not history:
-            st.info("Say hello to start the conversation.")
-
-        for msg in history:
-            role = msg.get("role", "user")
-            content = msg.get("content") or ""
-            _render_msg(st, role, content)
+        # Single slot so Clear can blank the list in place without a rerun
+        messages_box = st.empty()
+        with messages_box.container():
+            history = list(st.session_state.get(SESSION_HISTORY_KEY, ()))
+            if not history:
+                st.info("Say hello to start the conversation.")
+
+            # Only the most recent messages render inline; older ones go in an expander
+            tail = history
+            if len(history) > _VISIBLE_MESSAGES:
+                with st.expander(f"Earlier ({len(history) - _VISIBLE_MESSAGES} messages)"):
+                    for role, content in history[:-_VISIBLE_MESSAGES]:
+                        _render_msg(st, role, content or "")
+                tail = history[-_VISIBLE_MESSAGES:]
+
+            for role, content in tail:
+                _render_msg(st, role, content or "")
 
         st.divider()
 
@@ -328,65 +662,15 @@ def render_chat_widget_modern(
             st.button("Send", use_container_width=True, disabled=True, help="Use the input to send")
         with right_cols[2]:
             if clear_button and st.button("Clear", type="secondary", use_container_width=True):
-                st.session_state[SESSION_HISTORY_KEY] = []
-                st.rerun()
+                st.session_state[SESSION_HISTORY_KEY].clear()
+                messages_box.info("Say hello to start the conversation.")
+                return
 
+        if outbox is not None and outbox[0] == "prompt":
+            prompt = outbox[1]
         if not prompt:
-            # keep history cap
-            if len(st.session_state[SESSION_HISTORY_KEY]) > max_history:
-                st.session_state[SESSION_HISTORY_KEY] = st.session_state[SESSION_HISTORY_KEY][-max_history:]
             return
 
-        # Append user message
-        st.session_state[SESSION_HISTORY_KEY].append({"role": "user", "content": prompt})
-        _render_msg(st, "user", prompt)
-
-        # Payload
-        payload: Dict[str, Any] = {
-            "message": prompt,
-            "history": st.session_state[SESSION_HISTORY_KEY],
-            "system": system_hint,
-            "source": "streamlit",
-        }
-        if context is not None:
-            payload["context"] = context
-
-        # Call webhook
-        with (st.chat_message("assistant") if _HAS_CHAT_MESSAGE else st.container()):
-            placeholder = st.empty()
-            with st.spinner("Thinking…"):
-                try:
-                    resp = _post_with_retry(webhook_url, payload, timeout=60)
-                    try:
-                        data = resp.json()
-                    except Exception:
-                        data = {"reply": resp.text}
-
-                    reply_txt = None
-                    for k in ("reply", "message", "text"):
-                        v = data.get(k)
-                        if isinstance(v, str) and v.strip():
-                            reply_txt = v.strip()
-                            break
-                    if not reply_txt:
-                        reply_txt = "(No reply)"
-
-                    placeholder.markdown(reply_txt)
-
-                    suggestions = data.get("suggestions")
-                    if isinstance(suggestions, list) and suggestions:
-                        st.caption("Try:")
-                        for s in suggestions[:5]:
-                            if isinstance(s, str):
-                                st.code(s)
-
-                except Exception as e:
-                    reply_txt = f"Error: {e}"
-                    placeholder.error(reply_txt)
-
-        # Persist assistant reply
-        st.session_state[SESSION_HISTORY_KEY].append({"role": "assistant", "content": reply_txt})
-
-        # Cap history size
-        if len(st.session_state[SESSION_HISTORY_KEY]) > max_history:
-            st.session_state[SESSION_HISTORY_KEY] = st.session_state[SESSION_HISTORY_KEY][-max_history:]
+        _submit("prompt", prompt)
+
+_chat_card_fragment = _maybe_fragment(_chat_card)
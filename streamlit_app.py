@@ -1,6 +1,10 @@
+import functools
+import re
+import string
+
 import streamlit as st
+import numpy as np
 import pandas as pd
-import altair as alt
 from datetime import datetime
 
 # Embedded report data
@@ -66,18 +70,21 @@ REPORT_DATA = {
 }
 
 
-def sanitize_columns(df: pd.DataFrame):
-    """Return a copy of df with safe lower_snake_case column names and a mapping original->safe.
-    Ensures only [A-Za-z0-9_] and uniqueness.
-    """
-    import re
-    mapping = {}
+# Whitespace runs, "-" and "/" become "_"; anything else outside [0-9a-z_] is dropped
+_SEPARATORS_TO_UNDERSCORE = str.maketrans("-/", "__")
+_SAFE_CHARS = frozenset(string.ascii_lowercase + string.digits + "_")
+
+
+@functools.lru_cache(maxsize=128)
+def _safe_column_names(columns: tuple):
+    """Map each column label to a unique lower_snake_case name, memoized per column tuple."""
+    safe_names = []
     used = set()
-    for col in df.columns:
-        safe = col.strip().lower()
-        safe = re.sub(r"[\s\-/]+", "_", safe)
-        safe = re.sub(r"[^0-9a-zA-Z_]", "", safe)
-        safe = re.sub(r"_+", "_", safe).strip("_")
+    for col in columns:
+        safe = "_".join(col.lower().split()).translate(_SEPARATORS_TO_UNDERSCORE)
+        safe = "".join(ch for ch in safe if ch in _SAFE_CHARS)
+        # Collapse runs of "_" and trim them from both ends
+        safe = "_".join(part for part in safe.split("_") if part)
         if safe == "":
             safe = "col"
         base = safe
@@ -86,36 +93,81 @@ def sanitize_columns(df: pd.DataFrame):
             i += 1
             safe = f"{base}_{i}"
         used.add(safe)
-        mapping[col] = safe
-    df_safe = df.rename(columns=mapping).copy()
+        safe_names.append(safe)
+    return tuple(safe_names)
+
+
+def sanitize_columns(df: pd.DataFrame):
+    """Return df with safe lower_snake_case column names and a mapping original->safe.
+    Ensures only [A-Za-z0-9_] and uniqueness. When every name is already safe the
+    result is a shallow copy that shares column data with df: callers may assign
+    or replace whole columns, but must not write into it in place.
+    """
+    columns = tuple(df.columns)
+    mapping = dict(zip(columns, _safe_column_names(columns)))
+    if all(col == safe for col, safe in mapping.items()):
+        # Names are already safe: skip the rename copy (see docstring)
+        return df.copy(deep=False), mapping
+    # rename already returns a new frame; a second copy only doubles the allocation
+    df_safe = df.rename(columns=mapping)
     return df_safe, mapping
 
 
+_NUMERIC_STRIP = re.compile(r"[^0-9\.-]")
+
+
 def coerce_numeric(df: pd.DataFrame, cols):
     """Coerce specified columns to numeric by stripping non-numeric characters."""
-    import re
     for c in cols:
-        if c in df.columns:
-            df[c] = pd.to_numeric(
-                df[c]
-                .astype(str)
-                .str.replace(r"[^0-9\.-]", "", regex=True)
-                .replace({"": None}),
-                errors="coerce",
-            )
+        # Already-numeric columns need no string round-trip
+        if c in df.columns and df[c].dtype.kind not in "iufc":
+            col = df[c]
+            text = col.astype(str)
+            # Clean numeric strings parse directly; only the cells that fail
+            # are stripped and re-parsed, so each result depends on its own cell
+            out = pd.to_numeric(text, errors="coerce")
+            bad = out.isna() & col.notna()
+            if bad.any():
+                # Empty strings left after stripping become NaN under errors="coerce"
+                out[bad] = pd.to_numeric(
+                    text[bad].str.replace(_NUMERIC_STRIP, "", regex=True),
+                    errors="coerce",
+                )
+            # "inf"/"-inf" parse directly but are not valid chart values
+            df[c] = out.replace([np.inf, -np.inf], np.nan)
     return df
 
 
-def coerce_datetime(df: pd.DataFrame, cols):
-    """Coerce specified columns to datetime with errors coerced to NaT."""
+def coerce_datetime(df: pd.DataFrame, cols, fmt=None):
+    """Coerce specified columns to datetime with errors coerced to NaT.
+    fmt is passed to pd.to_datetime as format (e.g. "ISO8601") to skip format inference.
+    """
     for c in cols:
-        if c in df.columns:
-            df[c] = pd.to_datetime(df[c], errors="coerce")
+        # Already-parsed datetime columns need no second pass
+        if c in df.columns and df[c].dtype.kind != "M":
+            df[c] = pd.to_datetime(df[c], errors="coerce", format=fmt)
     return df
 
 
+# Dates in REPORT_DATA's trend table are ISO strings (YYYY-MM-DD); used by _render_line
+_REPORT_DATE_FORMAT = "ISO8601"
+
+
+@st.cache_data(show_spinner=False)
+def _prepare_chart_frame(df: pd.DataFrame, datetime_cols=(), numeric_cols=(), datetime_fmt=None):
+    """Sanitize df's columns and coerce the given (original-name) columns.
+    Returns (df_sanitized, mapping); cached so reruns skip the regex/parse passes.
+    """
+    df_safe, mapping = sanitize_columns(df)
+    df_safe = coerce_datetime(df_safe, [mapping.get(c, c) for c in datetime_cols], datetime_fmt)
+    df_safe = coerce_numeric(df_safe, [mapping.get(c, c) for c in numeric_cols])
+    return df_safe, mapping
+
+
 def safe_altair_chart(chart_builder_callable, fallback_df: pd.DataFrame = None):
-    """Safely build and render an Altair chart. On failure, show a warning and optional fallback table."""
+    """Safely build and render an Altair chart. On failure, show a warning and optional fallback table.
+    The builder may also return a (data, vega_lite_spec) pair, rendered with st.vega_lite_chart.
+    """
     try:
         chart = chart_builder_callable()
         if chart is None:
@@ -123,16 +175,81 @@ def safe_altair_chart(chart_builder_callable, fallback_df: pd.DataFrame = None):
             if fallback_df is not None:
                 st.dataframe(fallback_df)
             return
-        st.altair_chart(chart, use_container_width=True)
+        if isinstance(chart, tuple):
+            data, spec = chart
+            st.vega_lite_chart(data, spec, use_container_width=True)
+        else:
+            st.altair_chart(chart, use_container_width=True)
     except Exception:
         st.warning("Chart unavailable")
         if fallback_df is not None:
             st.dataframe(fallback_df)
 
 
-def _load_tables(report):
-    """Create a dict of DataFrames from report tables keyed by table name."""
-    tables = report.get("tables", [])
+_alt = None
+# chart type -> unbound alt.Chart mark method; filled in when Altair is imported
+_MARK_DISPATCH = {}
+
+
+def _altair():
+    """Import Altair on first use so reports without charts never pay for it."""
+    global _alt
+    if _alt is None:
+        import altair
+
+        # Process-wide transformer setting; applied once on first import
+        altair.data_transformers.disable_max_rows()
+        _MARK_DISPATCH.update(
+            bar=altair.Chart.mark_bar,
+            area=altair.Chart.mark_area,
+            line=altair.Chart.mark_line,
+        )
+        _alt = altair
+    return _alt
+
+
+@st.cache_data(show_spinner=False)
+def _chart_spec(kind, x, y, x_title=None, y_title=None, title=None):
+    """Build a report chart once with Altair and return its Vega-Lite spec without data.
+    Reruns reuse the cached dict and bind the frame through st.vega_lite_chart,
+    skipping Altair object construction and validation.
+    """
+    alt = _altair()
+    base = alt.Chart()
+    if kind == "line":
+        # Multi-series line over the long-form (x, value, series_name) frame
+        chart = base.mark_line(point=False).encode(
+            x=alt.X(f"{x}:temporal", title=x_title),
+            y=alt.Y(f"{y}:quantitative", title=y_title),
+            color=alt.Color("series_name:N", title="Series"),
+            tooltip=[x + ":temporal", "series_name:N", y + ":quantitative"],
+        )
+    elif kind == "pie":
+        chart = base.mark_arc().encode(
+            theta=alt.Theta(f"{y}:quantitative", aggregate="sum"),
+            color=alt.Color(f"{x}:nominal"),
+            tooltip=[x + ":nominal", y + ":quantitative"],
+        )
+    else:
+        chart = _MARK_DISPATCH.get(kind, alt.Chart.mark_bar)(base).encode(
+            x=alt.X(f"{x}:temporal", title=x_title),
+            y=alt.Y(f"{y}:quantitative", title=y_title),
+            tooltip=[x + ":temporal", y + ":quantitative"],
+        )
+    if title:
+        chart = chart.properties(title=title)
+    spec = chart.to_dict()
+    spec.pop("data", None)
+    spec.pop("datasets", None)
+    return spec
+
+
+@st.cache_resource(show_spinner=False)
+def _build_tables():
+    """Create a dict of DataFrames from the embedded report tables keyed by table name.
+    Built once per process and shared by every session; use _load_tables() instead.
+    """
+    tables = REPORT_DATA.get("tables", [])
     df_map = {}
     for t in tables:
         name = t.get("name", "Table")
@@ -147,29 +264,195 @@ def _load_tables(report):
     return df_map
 
 
+def _load_tables():
+    """Return this run's view of the report tables as shallow copies of the shared frames.
+    Reruns neither hash REPORT_DATA nor deep-copy the data. Callers may add, drop or
+    replace columns, but must not write into the frames in place.
+    """
+    return {name: df.copy(deep=False) for name, df in _build_tables().items()}
+
+
+def _resolve_table(df_map, required_cols):
+    """Resolve a table for a chart based on required columns."""
+    # Try to use echo.used.tables if available
+    used_tables = REPORT_DATA.get("echo", {}).get("used", {}).get("tables", [])
+    for ut in used_tables:
+        if ut in df_map:
+            df_candidate = df_map[ut]
+            if all(c in df_candidate.columns for c in required_cols):
+                return ut, df_candidate
+    # Otherwise search any table containing required columns
+    for name, df in df_map.items():
+        if all(c in df.columns for c in required_cols):
+            return name, df
+    # Fallback: first table if exists
+    if df_map:
+        name = list(df_map.keys())[0]
+        return name, df_map[name]
+    return None, None
+
+
+def _render_line(ch_type, spec, df_map):
+    # Expected: multi-series with xKey and series list; we'll reshape to long
+    x_key = spec.get("xKey")
+    series = spec.get("series", [])
+    y_original_cols = [s.get("yKey") for s in series if s.get("yKey")]
+    series_name_map = {s.get("yKey"): s.get("name", s.get("yKey")) for s in series if s.get("yKey")}
+
+    required = []
+    if x_key:
+        required.append(x_key)
+    required.extend(y_original_cols)
+    table_name, df_raw = _resolve_table(df_map, required)
+
+    st.markdown("**Trend: Sales and Registered Users**")
+
+    if df_raw is None or not required or any(c not in (df_raw.columns if df_raw is not None else []) for c in required):
+        st.warning("Chart unavailable")
+        # Show sanitized (fallback requirement) if possible
+        if df_raw is not None:
+            df_s, _ = sanitize_columns(df_raw)
+            st.dataframe(df_s)
+        return
+
+    # Sanitize columns and coerce types for charting
+    df_sanitized, mapping = _prepare_chart_frame(df_raw, (x_key,), tuple(y_original_cols), _REPORT_DATE_FORMAT)
+
+    # Resolve safe column names
+    safe_x = mapping.get(x_key, x_key)
+    safe_y_cols = [mapping.get(c, c) for c in y_original_cols]
+
+    # Map safe y col -> series display name
+    safe_to_series_name = {mapping.get(orig, orig): disp for orig, disp in series_name_map.items()}
+
+    # Build long-form dataframe in one allocation: x tiled once per
+    # series, y values stacked, series names repeated per row
+    value_cols = [c for c in safe_y_cols if c in df_sanitized.columns]
+    if value_cols and safe_x in df_sanitized.columns:
+        n_rows = len(df_sanitized)
+        long_df = pd.DataFrame(
+            {
+                safe_x: np.tile(df_sanitized[safe_x].to_numpy(), len(value_cols)),
+                "value": np.concatenate([df_sanitized[c].to_numpy(dtype=float) for c in value_cols]),
+                "series_name": pd.Categorical(np.repeat([safe_to_series_name.get(c, c) for c in value_cols], n_rows)),
+            }
+        )
+    else:
+        long_df = pd.DataFrame(columns=[safe_x, "value", "series_name"])  # empty fall-back
+
+    # Validate non-null rows for x and y
+    if not long_df.empty:
+        # long_df holds exactly these columns: filter rows with one fused mask, no projection copy
+        valid_df = long_df[long_df[safe_x].notna().to_numpy() & long_df["value"].notna().to_numpy()]
+    else:
+        valid_df = long_df
+
+    def build_chart():
+        if valid_df is None or valid_df.empty:
+            return None
+        # Basic line chart with color for series
+        return valid_df, _chart_spec("line", safe_x, "value", x_key, "Value", f"{table_name} — Trend")
+
+    # Render chart safely; fallback shows sanitized table
+    safe_altair_chart(build_chart, fallback_df=df_sanitized)
+
+
+def _render_bar(ch_type, spec, df_map):
+    # Not present in current report, but keep a safe generic path
+    x_key = spec.get("xKey")
+    y_key = None
+    # Try to deduce y from spec
+    if isinstance(spec.get("series"), list) and spec["series"]:
+        y_key = spec["series"][0].get("yKey")
+    else:
+        y_key = spec.get("yKey")
+
+    required = [c for c in [x_key, y_key] if c]
+    table_name, df_raw = _resolve_table(df_map, required)
+
+    if df_raw is None or any(c not in df_raw.columns for c in required):
+        st.warning("Chart unavailable")
+        if df_raw is not None:
+            df_s, _ = sanitize_columns(df_raw)
+            st.dataframe(df_s)
+        return
+
+    # Generic path: keep format inference so non-ISO date layouts still parse
+    df_sanitized, mapping = _prepare_chart_frame(df_raw, (x_key,), (y_key,))
+    safe_x = mapping.get(x_key, x_key)
+    safe_y = mapping.get(y_key, y_key)
+
+    valid_mask = df_sanitized[safe_x].notna().to_numpy() & df_sanitized[safe_y].notna().to_numpy()
+    valid_df = df_sanitized.loc[valid_mask, [safe_x, safe_y]]
+
+    def build_chart():
+        if valid_df.empty:
+            return None
+        return valid_df, _chart_spec(ch_type, safe_x, safe_y, x_key, y_key)
+
+    safe_altair_chart(build_chart, fallback_df=df_sanitized)
+
+
+def _render_pie(ch_type, spec, df_map):
+    # Implement as arc chart if ever present
+    dim = spec.get("category") or spec.get("dimension") or spec.get("xKey")
+    val = spec.get("value") or spec.get("yKey")
+    required = [c for c in [dim, val] if c]
+    table_name, df_raw = _resolve_table(df_map, required)
+
+    if df_raw is None or any(c not in df_raw.columns for c in required):
+        st.warning("Chart unavailable")
+        if df_raw is not None:
+            df_s, _ = sanitize_columns(df_raw)
+            st.dataframe(df_s)
+        return
+
+    df_sanitized, mapping = _prepare_chart_frame(df_raw, (), (val,))
+    safe_dim = mapping.get(dim, dim)
+    safe_val = mapping.get(val, val)
+
+    valid_df = df_sanitized.loc[df_sanitized[safe_val].notna().to_numpy(), [safe_dim, safe_val]]
+
+    def build_chart():
+        if valid_df.empty:
+            return None
+        return valid_df, _chart_spec("pie", safe_dim, safe_val)
+
+    safe_altair_chart(build_chart, fallback_df=df_sanitized)
+
+
+# chart type -> render handler, looked up once per chart
+_CHART_HANDLERS = {
+    "line": _render_line,
+    "bar": _render_bar,
+    "area": _render_bar,
+    "pie": _render_pie,
+}
+
+
 def render_app():
     # Guard page config to avoid duplication on reruns/imports
     if not st.session_state.get("_page_config_set", False):
         st.set_page_config(page_title="AI Report", layout="wide")
         st.session_state["_page_config_set"] = True
 
-    # Altair setup
-    alt.data_transformers.disable_max_rows()
-
     st.title("AI Report")
 
     # Summary
     summary = REPORT_DATA.get("summary", [])
     if summary:
         st.subheader("Summary")
-        for s in summary:
-            st.markdown(f"- {s}")
+        st.markdown("\n".join(f"- {s}" for s in summary))
 
     # Tables
-    df_map = _load_tables(REPORT_DATA)
+    df_map = _load_tables()
     if df_map:
         st.subheader("Data Tables")
         for name, df in df_map.items():
+            # Single-value tables render as a metric, skipping the Arrow round-trip
+            if df.shape == (1, 1):
+                st.metric(name, str(df.iat[0, 0]))
+                continue
             st.markdown(f"**{name}**")
             st.dataframe(df)
 
@@ -178,190 +461,14 @@ def render_app():
     if charts:
         st.subheader("Charts")
 
-    # Helper to resolve a table for a chart based on required columns
-    def resolve_table(required_cols):
-        # Try to use echo.used.tables if available
-        used_tables = REPORT_DATA.get("echo", {}).get("used", {}).get("tables", [])
-        for ut in used_tables:
-            if ut in df_map:
-                df_candidate = df_map[ut]
-                if all(c in df_candidate.columns for c in required_cols):
-                    return ut, df_candidate
-        # Otherwise search any table containing required columns
-        for name, df in df_map.items():
-            if all(c in df.columns for c in required_cols):
-                return name, df
-        # Fallback: first table if exists
-        if df_map:
-            name = list(df_map.keys())[0]
-            return name, df_map[name]
-        return None, None
-
     for ch in charts:
         ch_type = ch.get("type", "").lower()
-        spec = ch.get("spec", {})
-
-        if ch_type == "line":
-            # Expected: multi-series with xKey and series list; we'll reshape to long
-            x_key = spec.get("xKey")
-            series = spec.get("series", [])
-            y_original_cols = [s.get("yKey") for s in series if s.get("yKey")]
-            series_name_map = {s.get("yKey"): s.get("name", s.get("yKey")) for s in series if s.get("yKey")}
-
-            required = []
-            if x_key:
-                required.append(x_key)
-            required.extend(y_original_cols)
-            table_name, df_raw = resolve_table(required)
-
-            st.markdown("**Trend: Sales and Registered Users**")
-
-            if df_raw is None or not required or any(c not in (df_raw.columns if df_raw is not None else []) for c in required):
-                st.warning("Chart unavailable")
-                # Show sanitized (fallback requirement) if possible
-                if df_raw is not None:
-                    df_s, _ = sanitize_columns(df_raw)
-                    st.dataframe(df_s)
-                continue
-
-            # Sanitize columns for charting
-            df_sanitized, mapping = sanitize_columns(df_raw)
-
-            # Resolve safe column names
-            safe_x = mapping.get(x_key, x_key)
-            safe_y_cols = [mapping.get(c, c) for c in y_original_cols]
-
-            # Coerce types
-            df_sanitized = coerce_datetime(df_sanitized, [safe_x])
-            df_sanitized = coerce_numeric(df_sanitized, safe_y_cols)
-
-            # Build long-form dataframe
-            try:
-                long_df = df_sanitized.melt(
-                    id_vars=[safe_x],
-                    value_vars=[c for c in safe_y_cols if c in df_sanitized.columns],
-                    var_name="metric",
-                    value_name="value",
-                )
-            except Exception:
-                long_df = pd.DataFrame(columns=[safe_x, "metric", "value"])  # empty fall-back
-
-            # Map metric (safe col names) to friendly series names
-            # Build a mapping from safe y col -> series display name
-            safe_to_series_name = {}
-            for orig, disp in series_name_map.items():
-                safe_to_series_name[mapping.get(orig, orig)] = disp
-            long_df["series_name"] = long_df["metric"].map(lambda v: safe_to_series_name.get(v, v))
-
-            # Validate non-null rows for x and y
-            valid_df = long_df[[safe_x, "value", "series_name"]].dropna(subset=[safe_x, "value"]) if not long_df.empty else long_df
-
-            def build_chart():
-                if valid_df is None or valid_df.empty:
-                    return None
-                # Basic altair line chart with color for series
-                chart = (
-                    alt.Chart(valid_df)
-                    .mark_line(point=False)
-                    .encode(
-                        x=alt.X(f"{safe_x}:temporal", title=x_key),
-                        y=alt.Y("value:quantitative", title="Value"),
-                        color=alt.Color("series_name:N", title="Series"),
-                        tooltip=[safe_x + ":temporal", "series_name:N", "value:quantitative"],
-                    )
-                    .properties(title=f"{table_name} — Trend")
-                )
-                return chart
-
-            # Render chart safely; fallback shows sanitized table
-            safe_altair_chart(build_chart, fallback_df=df_sanitized)
-
-        elif ch_type in {"bar", "area"}:
-            # Not present in current report, but keep a safe generic path
-            x_key = spec.get("xKey")
-            y_key = None
-            # Try to deduce y from spec
-            if isinstance(spec.get("series"), list) and spec["series"]:
-                y_key = spec["series"][0].get("yKey")
-            else:
-                y_key = spec.get("yKey")
-
-            required = [c for c in [x_key, y_key] if c]
-            table_name, df_raw = resolve_table(required)
-
-            if df_raw is None or any(c not in df_raw.columns for c in required):
-                st.warning("Chart unavailable")
-                if df_raw is not None:
-                    df_s, _ = sanitize_columns(df_raw)
-                    st.dataframe(df_s)
-                continue
-
-            df_sanitized, mapping = sanitize_columns(df_raw)
-            safe_x = mapping.get(x_key, x_key)
-            safe_y = mapping.get(y_key, y_key)
-
-            df_sanitized = coerce_datetime(df_sanitized, [safe_x])
-            df_sanitized = coerce_numeric(df_sanitized, [safe_y])
-
-            valid_df = df_sanitized[[safe_x, safe_y]].dropna(subset=[safe_x, safe_y])
-
-            def build_chart():
-                if valid_df.empty:
-                    return None
-                mark = alt.MarkDef(type="bar") if ch_type == "bar" else alt.MarkDef(type="area")
-                chart = (
-                    alt.Chart(valid_df)
-                    .mark_bar() if ch_type == "bar" else alt.Chart(valid_df).mark_area()
-                )
-                chart = chart.encode(
-                    x=alt.X(f"{safe_x}:temporal", title=x_key),
-                    y=alt.Y(f"{safe_y}:quantitative", title=y_key),
-                    tooltip=[safe_x + ":temporal", safe_y + ":quantitative"],
-                )
-                return chart
-
-            safe_altair_chart(build_chart, fallback_df=df_sanitized)
-
-        elif ch_type == "pie":
-            # Implement as arc chart if ever present
-            dim = spec.get("category") or spec.get("dimension") or spec.get("xKey")
-            val = spec.get("value") or spec.get("yKey")
-            required = [c for c in [dim, val] if c]
-            table_name, df_raw = resolve_table(required)
-
-            if df_raw is None or any(c not in df_raw.columns for c in required):
-                st.warning("Chart unavailable")
-                if df_raw is not None:
-                    df_s, _ = sanitize_columns(df_raw)
-                    st.dataframe(df_s)
-                continue
-
-            df_sanitized, mapping = sanitize_columns(df_raw)
-            safe_dim = mapping.get(dim, dim)
-            safe_val = mapping.get(val, val)
-
-            df_sanitized = coerce_numeric(df_sanitized, [safe_val])
-
-            valid_df = df_sanitized[[safe_dim, safe_val]].dropna(subset=[safe_val])
-
-            def build_chart():
-                if valid_df.empty:
-                    return None
-                chart = (
-                    alt.Chart(valid_df)
-                    .mark_arc()
-                    .encode(
-                        theta=alt.Theta(f"{safe_val}:quantitative", aggregate="sum"),
-                        color=alt.Color(f"{safe_dim}:nominal"),
-                        tooltip=[safe_dim + ":nominal", safe_val + ":quantitative"],
-                    )
-                )
-                return chart
-
-            safe_altair_chart(build_chart, fallback_df=df_sanitized)
-        else:
+        handler = _CHART_HANDLERS.get(ch_type)
+        if handler is None:
             # Unknown chart type; skip safely
             st.warning("Chart unavailable")
+            continue
+        handler(ch_type, ch.get("spec", {}), df_map)
 
 
 # Note: Do not execute render_app() on import; it will be called by the runner.